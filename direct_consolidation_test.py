@@ -5,181 +5,347 @@ Direct test of LlamaIndex Security Consolidation Analysis
 
 import os
 import sys
+import orjson
+import hashlib
+import logging
+import functools
 from datetime import datetime
-from llama_index.core import SimpleDirectoryReader
+import httpx
+from diskcache import Cache
+from google.genai import types as genai_types
 from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.core import VectorStoreIndex
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
-import tempfile
-import shutil
 
-def main():
-    gemini_file = "security_analysis_20250708_170028.txt"
-    prowler_file = "prowler_scan_20250708_165838.ocsf_cleaned.json"
-    output_file = f"llamaindex_consolidated_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
-    
-    print("DEBUG: Starting LlamaIndex consolidation analysis...")
-    print(f"DEBUG: Gemini file: {gemini_file}")
-    print(f"DEBUG: Prowler file: {prowler_file}")
-    print(f"DEBUG: Output file: {output_file}")
-    
-    # Setup Gemini 2.5 Flash with enhanced context
-    llm = GoogleGenAI(
+log = logging.getLogger(__name__)
+
+# Completion cache keyed by (model, prompt); identical reruns during
+# iteration return in milliseconds at zero LLM cost
+LLM_CACHE = Cache('./.llm_cache')
+
+
+def llm_cache_key(model, prompt):
+    return hashlib.sha256(f"{model}|{prompt}".encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
+def get_llm():
+    """Shared Gemini client; reused so the httpx pool and auth are built once.
+
+    GoogleGenAI does not take an httpx client directly; async_client_args
+    is the google-genai hook that forwards these kwargs to the AsyncClient
+    it builds. HTTP/2 lets concurrent completion/embedding requests
+    multiplex over one TLS connection instead of queueing on HTTP/1.1
+    connections.
+    """
+    return GoogleGenAI(
         model="gemini-2.5-flash",
         max_tokens=32000,
-        temperature=0.1  # Lower temperature for focused analysis
+        temperature=0.1,  # Lower temperature for focused analysis
+        http_options=genai_types.HttpOptions(
+            async_client_args={
+                "http2": True,
+                "limits": httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                "timeout": 60,
+            },
+        ),
     )
-    
-    embed_model = GoogleGenAIEmbedding(
-        model_name="text-embedding-004"
+
+
+@functools.lru_cache(maxsize=1)
+def get_embed_model():
+    """Shared embedding client for the legacy RAG path."""
+    from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+    return GoogleGenAIEmbedding(
+        model_name="text-embedding-004",
+        embed_batch_size=100  # One HTTP request per 100 chunks, not per chunk
     )
-    
-    # Create temporary directory and copy files for SimpleDirectoryReader
-    with tempfile.TemporaryDirectory() as temp_dir:
-        print("DEBUG: Setting up analysis workspace...")
-        
-        # Copy files to temp directory with descriptive names
-        gemini_copy = os.path.join(temp_dir, "gemini_security_analysis.txt")
-        prowler_copy = os.path.join(temp_dir, "prowler_vulnerability_scan.json")
-        
-        shutil.copy2(gemini_file, gemini_copy)
-        shutil.copy2(prowler_file, prowler_copy)
-        
-        # Load documents using SimpleDirectoryReader
-        print("DEBUG: Loading security analysis documents...")
-        reader = SimpleDirectoryReader(temp_dir)
-        documents = reader.load_data()
-        
-        print(f"DEBUG: Loaded {len(documents)} documents for consolidation")
-        
-        # Create vector index for context-aware analysis
-        print("DEBUG: Creating vector index for context-aware analysis...")
-        index = VectorStoreIndex.from_documents(
-            documents, 
-            llm=llm,
-            embed_model=embed_model
-        )
-        
-        # Create query engine with comprehensive retrieval
-        query_engine = index.as_query_engine(
-            llm=llm,
-            similarity_top_k=15,  # Get comprehensive context
-            response_mode="tree_summarize"  # Better for long documents
-        )
-        
-        # Comprehensive consolidation query
-        consolidation_query = """
-        You are a senior cybersecurity consultant conducting an in-depth security consolidation analysis. 
-        
-        Analyze the provided Gemini AI security analysis and Prowler vulnerability scan findings to create a comprehensive, executive-level security assessment report.
-
-        ## CONSOLIDATION ANALYSIS REQUIREMENTS:
-
-        ### 1. EXECUTIVE SUMMARY (Critical)
-        - Overall security posture: CRITICAL/HIGH/MEDIUM/LOW risk rating
-        - Total vulnerability count by severity with percentages
-        - Top 5 most critical security issues requiring immediate executive attention
-        - Business risk assessment and potential impact (financial, operational, regulatory)
-        - Compliance status and regulatory implications
-
-        ### 2. COMPARATIVE METHODOLOGY ANALYSIS
-        - Gemini AI analysis strengths: configuration review, architectural analysis, best practices
-        - Prowler automated scanning coverage: compliance checks, policy violations, resource scans
-        - Methodology gaps and complementary coverage areas
-        - Confidence levels and false positive assessments
-
-        ### 3. CRITICAL VULNERABILITY CORRELATION
-        - Security issues confirmed by BOTH tools (highest confidence)
-        - Severity alignment and discrepancies between tools
-        - Cross-validation of findings for accuracy
-        - Immediate action items with business justification
-
-        ### 4. UNIQUE FINDINGS ANALYSIS
-        #### Gemini AI Exclusive Insights:
-        - Deep architectural security analysis
-        - Configuration best practice violations  
-        - Security design pattern recommendations
-        - Context-aware risk assessments
-
-        #### Prowler Exclusive Discoveries:
-        - Automated compliance rule violations
-        - Resource-specific misconfigurations
-        - Policy enforcement gaps
-        - Audit trail and logging deficiencies
-
-        ### 5. RISK PRIORITIZATION MATRIX
-        Create detailed priority matrix with:
-        - **CRITICAL (P0)**: Immediate remediation (0-24 hours) - Active security threats
-        - **HIGH (P1)**: Priority remediation (1-7 days) - Significant exposure risks  
-        - **MEDIUM (P2)**: Planned remediation (1-30 days) - Best practice violations
-        - **LOW (P3)**: Strategic improvements (30+ days) - Optimization opportunities
-
-        For each priority level, provide:
-        - Specific vulnerability list with CVE/CWE references where applicable
-        - Business impact assessment
-        - Remediation effort estimates (hours/days)
-        - Required expertise and resources
-
-        ### 6. COMPREHENSIVE REMEDIATION ROADMAP
-        For each CRITICAL and HIGH finding:
-        - Step-by-step remediation procedures
-        - Terraform code fixes where applicable
-        - Configuration changes required
-        - Testing and validation steps
-        - Rollback procedures if needed
-
-        Create a professional, executive-ready report formatted in proper Markdown with clear sections, bullet points, and actionable recommendations.
-        """
-        
-        print("DEBUG: Executing consolidation analysis query...")
-        try:
-            # Run the consolidation analysis
-            consolidation_response = query_engine.query(consolidation_query)
-            consolidation_report = str(consolidation_response)
-            
-            print(f"DEBUG: Query completed - response length: {len(consolidation_report)} characters")
-            
-            # Create comprehensive final report with professional formatting
-            final_report = f"""# Cloud Security Consolidation Analysis Report
-
-**Project:** inbound-entity-461511-j4  
-**Analysis Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  
-**Analysis Method:** LlamaIndex + Gemini 2.5 Flash + Prowler Integration  
-**Report Classification:** CONFIDENTIAL - Internal Security Assessment  
+
+# Static report skeleton, formatted once per run
+REPORT_HEADER = """# Cloud Security Consolidation Analysis Report
+
+**Project:** inbound-entity-461511-j4
+**Analysis Date:** {date}
+**Analysis Method:** LlamaIndex + Gemini 2.5 Flash + Prowler Integration
+**Report Classification:** CONFIDENTIAL - Internal Security Assessment
 
 ---
 
-{consolidation_report}
+"""
+
+REPORT_FOOTER = """
 
 ---
 
 ## APPENDIX: Technical Analysis Details
 
-**Analysis Framework:** LlamaIndex with vector-based context retrieval  
-**Context Window:** 1M tokens (Gemini 2.5 Flash)  
-**Embedding Model:** Google Text Embedding 004  
-**Retrieval Strategy:** Top-15 similarity with tree summarization  
-**Temperature Setting:** 0.1 (focused analysis)  
+**Analysis Framework:** LlamaIndex direct consolidation (single-prompt)
+**Context Window:** 1M tokens (Gemini 2.5 Flash)
+**Temperature Setting:** 0.1 (focused analysis)
 
-**Report Validation:** Cross-referenced findings between Gemini AI analysis and Prowler automated scanning  
-**Confidence Level:** High (findings validated across multiple analysis methods)  
+**Report Validation:** Cross-referenced findings between Gemini AI analysis and Prowler automated scanning
+**Confidence Level:** High (findings validated across multiple analysis methods)
 
 *This report was generated using advanced AI-powered security analysis tools and should be reviewed by qualified security professionals.*
 """
-            
-            # Write to output file
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(final_report)
-            
-            print(f"DEBUG: Consolidation analysis completed successfully!")
-            print(f"DEBUG: Report saved to: {output_file}")
-            print(f"DEBUG: Report size: {len(final_report):,} characters")
-            
-        except Exception as e:
-            print(f"ERROR: Consolidation analysis failed: {e}")
-            import traceback
-            traceback.print_exc()
-            sys.exit(1)
+
+CONSOLIDATION_INSTRUCTIONS = """
+You are a senior cybersecurity consultant conducting an in-depth security consolidation analysis.
+
+Analyze the provided Gemini AI security analysis and Prowler vulnerability scan findings to create a comprehensive, executive-level security assessment report.
+
+## CONSOLIDATION ANALYSIS REQUIREMENTS:
+
+### 1. EXECUTIVE SUMMARY (Critical)
+- Overall security posture: CRITICAL/HIGH/MEDIUM/LOW risk rating
+- Total vulnerability count by severity with percentages
+- Top 5 most critical security issues requiring immediate executive attention
+- Business risk assessment and potential impact (financial, operational, regulatory)
+- Compliance status and regulatory implications
+
+### 2. COMPARATIVE METHODOLOGY ANALYSIS
+- Gemini AI analysis strengths: configuration review, architectural analysis, best practices
+- Prowler automated scanning coverage: compliance checks, policy violations, resource scans
+- Methodology gaps and complementary coverage areas
+- Confidence levels and false positive assessments
+
+### 3. CRITICAL VULNERABILITY CORRELATION
+- Security issues confirmed by BOTH tools (highest confidence)
+- Severity alignment and discrepancies between tools
+- Cross-validation of findings for accuracy
+- Immediate action items with business justification
+
+### 4. UNIQUE FINDINGS ANALYSIS
+#### Gemini AI Exclusive Insights:
+- Deep architectural security analysis
+- Configuration best practice violations
+- Security design pattern recommendations
+- Context-aware risk assessments
+
+#### Prowler Exclusive Discoveries:
+- Automated compliance rule violations
+- Resource-specific misconfigurations
+- Policy enforcement gaps
+- Audit trail and logging deficiencies
+
+### 5. RISK PRIORITIZATION MATRIX
+Create detailed priority matrix with:
+- **CRITICAL (P0)**: Immediate remediation (0-24 hours) - Active security threats
+- **HIGH (P1)**: Priority remediation (1-7 days) - Significant exposure risks
+- **MEDIUM (P2)**: Planned remediation (1-30 days) - Best practice violations
+- **LOW (P3)**: Strategic improvements (30+ days) - Optimization opportunities
+
+For each priority level, provide:
+- Specific vulnerability list with CVE/CWE references where applicable
+- Business impact assessment
+- Remediation effort estimates (hours/days)
+- Required expertise and resources
+
+### 6. COMPREHENSIVE REMEDIATION ROADMAP
+For each CRITICAL and HIGH finding:
+- Step-by-step remediation procedures
+- Terraform code fixes where applicable
+- Configuration changes required
+- Testing and validation steps
+- Rollback procedures if needed
+
+Create a professional, executive-ready report formatted in proper Markdown with clear sections, bullet points, and actionable recommendations.
+"""
+
+
+def filter_prowler_findings(prowler_file: str) -> str:
+    """Project the Prowler OCSF JSON down to failing findings only.
+
+    OCSF records carry verbose resource metadata and thousands of PASS
+    entries that are irrelevant to consolidation; keeping just the FAIL/NEW
+    records and their key fields cuts prompt tokens by up to 10x.
+    """
+    with open(prowler_file, 'rb') as f:
+        records = orjson.loads(f.read())
+
+    if not isinstance(records, list):
+        # Unexpected shape - pass through untouched
+        return orjson.dumps(records).decode()
+
+    slim = []
+    for record in records:
+        if record.get('status_code') not in ('FAIL', 'NEW'):
+            continue
+        slim.append({
+            'check_id': record.get('unmapped', {}).get('check_id'),
+            'title': record.get('finding_info', {}).get('title'),
+            'severity': record.get('severity'),
+            'status_code': record.get('status_code'),
+            'resources': [r.get('uid') for r in record.get('resources', [])],
+            'remediation': record.get('remediation', {}).get('desc'),
+        })
+
+    log.debug(f"Filtered Prowler findings: {len(slim)} failing of {len(records)} total")
+    return orjson.dumps(slim, option=orjson.OPT_INDENT_2).decode()
+
+
+def run_rag_consolidation(llm, gemini_file: str, prowler_file: str):
+    """Legacy RAG path: index both files and query with retrieval.
+
+    Kept for comparison runs (set USE_RAG=1); the direct single-prompt path is
+    the default because both documents fit Gemini 2.5 Flash's 1M-token context.
+    """
+    import chromadb
+    from llama_index.core import Document, StorageContext, VectorStoreIndex
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    embed_model = get_embed_model()
+
+    # Cache the built index keyed by source content so unchanged inputs skip
+    # the embedding HTTP calls entirely on repeat runs. ChromaDB replaces the
+    # default simple store's O(N) Python cosine scan with a compiled HNSW
+    # index and survives process restarts without an explicit persist step.
+    with open(gemini_file, 'rb') as f:
+        content_hash = hashlib.sha256(f.read())
+    with open(prowler_file, 'rb') as f:
+        content_hash.update(f.read())
+    chroma_client = chromadb.PersistentClient(path="./.index_cache/chroma")
+    chroma_collection = chroma_client.get_or_create_collection(
+        f"consolidation_{content_hash.hexdigest()[:16]}"
+    )
+    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+
+    if chroma_collection.count() > 0:
+        log.debug(f"Reusing cached vector index: {chroma_collection.name}")
+        index = VectorStoreIndex.from_vector_store(
+            vector_store,
+            embed_model=embed_model
+        )
+    else:
+        # Build Document objects directly from the source files instead of
+        # copying them to a temp dir for SimpleDirectoryReader to re-read
+        log.debug("Loading security analysis documents...")
+        with open(gemini_file, 'r', encoding='utf-8') as f:
+            gemini_doc = Document(text=f.read(), metadata={"source": "gemini"})
+        # Index only the failing findings, not the full OCSF dump
+        prowler_doc = Document(
+            text=filter_prowler_findings(prowler_file),
+            metadata={"source": "prowler"}
+        )
+        documents = [gemini_doc, prowler_doc]
+
+        log.debug(f"Loaded {len(documents)} documents for consolidation")
+
+        # Create vector index for context-aware analysis
+        log.debug("Creating vector index for context-aware analysis...")
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        index = VectorStoreIndex.from_documents(
+            documents,
+            llm=llm,
+            embed_model=embed_model,
+            storage_context=storage_context,
+            insert_batch_size=2048,  # Batch node inserts into the store
+            use_async=True  # Dispatch embedding batches concurrently
+        )
+        log.debug(f"Persisted vector index to collection: {chroma_collection.name}")
+
+    # Compact stuffs all retrieved chunks into one LLM call instead of the
+    # recursive multi-call fanout tree_summarize pays; with only 2 source
+    # documents a small top-k already covers the corpus
+    query_engine = index.as_query_engine(
+        llm=llm,
+        similarity_top_k=5,
+        response_mode="compact",
+        use_async=True,  # Gather any multi-call synthesis concurrently
+        streaming=True  # Flush tokens to disk as they arrive
+    )
+
+    return query_engine.query(CONSOLIDATION_INSTRUCTIONS).response_gen
+
+
+def run_direct_consolidation(llm, gemini_file: str, prowler_file: str):
+    """Default path: send both files in one prompt, no indexing.
+
+    With only 2 source documents the embed/retrieve/tree-summarize round-trip
+    adds hundreds of embedding calls and multiple LLM calls for no benefit;
+    a single stuffed prompt is one LLM call.
+    """
+    log.debug("Reading source files for direct consolidation...")
+    with open(gemini_file, 'r', encoding='utf-8') as f:
+        gemini_content = f.read()
+    prowler_content = filter_prowler_findings(prowler_file)
+
+    log.debug(f"Gemini analysis length: {len(gemini_content)} characters")
+    log.debug(f"Prowler findings length: {len(prowler_content)} characters")
+
+    consolidation_prompt = f"""{CONSOLIDATION_INSTRUCTIONS}
+
+## SOURCE DATA:
+
+### GEMINI AI SECURITY ANALYSIS:
+{gemini_content}
+
+### PROWLER VULNERABILITY FINDINGS:
+{prowler_content}
+"""
+
+    cache_key = llm_cache_key(llm.model, consolidation_prompt)
+    cached = LLM_CACHE.get(cache_key)
+    if cached is not None:
+        log.debug("LLM cache hit - reusing previous consolidation")
+        return iter([cached])
+
+    def stream_and_cache():
+        parts = []
+        for chunk in llm.stream_complete(consolidation_prompt):
+            parts.append(chunk.delta)
+            yield chunk.delta
+        LLM_CACHE.set(cache_key, ''.join(parts))
+
+    return stream_and_cache()
+
+
+def main():
+    gemini_file = "security_analysis_20250708_170028.txt"
+    prowler_file = "prowler_scan_20250708_165838.ocsf_cleaned.json"
+    # Single timestamp for both the filename and the report header
+    now = datetime.now()
+    output_file = f"llamaindex_consolidated_report_{now.strftime('%Y%m%d_%H%M%S')}.md"
+    use_rag = os.environ.get("USE_RAG", "0") == "1"
+
+    log.debug("Starting LlamaIndex consolidation analysis...")
+    log.debug(f"Gemini file: {gemini_file}")
+    log.debug(f"Prowler file: {prowler_file}")
+    log.debug(f"Output file: {output_file}")
+    log.debug(f"Mode: {'RAG (legacy)' if use_rag else 'direct single-prompt'}")
+
+    # Setup Gemini 2.5 Flash with enhanced context (cached client)
+    llm = get_llm()
+
+    log.debug("Executing consolidation analysis query...")
+    try:
+        if use_rag:
+            token_stream = run_rag_consolidation(llm, gemini_file, prowler_file)
+        else:
+            token_stream = run_direct_consolidation(llm, gemini_file, prowler_file)
+
+        report_header = REPORT_HEADER.format(
+            date=now.strftime('%Y-%m-%d %H:%M:%S')
+        )
+
+        # Stream tokens through a 1 MiB write buffer; the buffer keeps
+        # syscall count low while tokens still land incrementally
+        report_size = len(report_header) + len(REPORT_FOOTER)
+        with open(output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.write(report_header)
+            for chunk in token_stream:
+                f.write(chunk)
+                report_size += len(chunk)
+            f.write(REPORT_FOOTER)
+
+        log.debug(f"Consolidation analysis completed successfully!")
+        log.debug(f"Report saved to: {output_file}")
+        log.debug(f"Report size: {report_size:,} characters")
+
+    except Exception as e:
+        log.error(f"Consolidation analysis failed: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "WARNING"))
+    main()
@@ -6,125 +6,300 @@ Reads Gemini analysis and Prowler findings directly and creates consolidation re
 
 import os
 import sys
+import orjson
+import asyncio
+import hashlib
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
+import httpx
+from diskcache import Cache
+from google.genai import types as genai_types
+from llama_index.core.utilities.token_counting import TokenCounter
 from llama_index.llms.google_genai import GoogleGenAI
 
-def main():
-    if len(sys.argv) != 4:
-        print("Usage: python3 script.py <gemini_file> <prowler_file> <output_file>")
-        sys.exit(1)
-    
-    gemini_file = sys.argv[1]
-    prowler_file = sys.argv[2]
-    output_file = sys.argv[3]
-    
-    print("DEBUG: Starting simple consolidation analysis...")
-    print(f"DEBUG: Gemini file: {gemini_file}")
-    print(f"DEBUG: Prowler file: {prowler_file}")
-    print(f"DEBUG: Output file: {output_file}")
-    
-    # Setup Gemini 2.5 Flash with reduced output tokens
-    llm = GoogleGenAI(
+log = logging.getLogger(__name__)
+
+# Leave headroom below Gemini 2.5 Flash's 1M-token context for the prompt
+# skeleton and the generated output
+TOKEN_BUDGET = 900_000
+
+# Completion cache keyed by (model, prompt); identical reruns during
+# iteration return in milliseconds at zero LLM cost
+LLM_CACHE = Cache('./.llm_cache')
+
+
+def llm_cache_key(model, prompt):
+    return hashlib.sha256(f"{model}|{prompt}".encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
+def get_llm():
+    """Shared Gemini client; reused so the httpx pool and auth are built once.
+
+    GoogleGenAI does not take an httpx client directly; async_client_args
+    is the google-genai hook that forwards these kwargs to the AsyncClient
+    it builds. HTTP/2 lets the concurrent section completions multiplex
+    over one TLS connection instead of queueing on HTTP/1.1 connections.
+    """
+    return GoogleGenAI(
         model="gemini-2.5-flash",
         max_tokens=8000,  # Reduced to avoid MAX_TOKENS error
-        temperature=0.1
+        temperature=0.1,
+        http_options=genai_types.HttpOptions(
+            async_client_args={
+                "http2": True,
+                "limits": httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                "timeout": 60,
+            },
+        ),
     )
-    
-    try:
-        # Read both files directly
-        print("DEBUG: Reading Gemini analysis file...")
-        with open(gemini_file, 'r', encoding='utf-8') as f:
-            gemini_content = f.read()
-        
-        print("DEBUG: Reading Prowler findings file...")
-        with open(prowler_file, 'r', encoding='utf-8') as f:
-            prowler_content = f.read()
-        
-        print(f"DEBUG: Gemini analysis length: {len(gemini_content)} characters")
-        print(f"DEBUG: Prowler findings length: {len(prowler_content)} characters")
-        
-        # Create consolidation prompt with both contents
-        consolidation_prompt = f"""
-You are a senior cybersecurity consultant. Analyze the provided Gemini AI security analysis and Prowler vulnerability scan findings to create a concise executive-level security consolidation report.
 
-GEMINI AI SECURITY ANALYSIS:
-{gemini_content}
+# Static report skeleton, formatted once per run
+REPORT_HEADER = """# Cloud Security Consolidation Analysis Report
 
-PROWLER VULNERABILITY FINDINGS:
-{prowler_content}
+**Project:** inbound-entity-461511-j4
+**Analysis Date:** {date}
+**Analysis Method:** Direct File Analysis + LlamaIndex LLM
+**Report Classification:** CONFIDENTIAL - Internal Security Assessment
 
-Create a professional consolidation report with these sections:
+---
 
-## Executive Summary
+"""
+
+REPORT_FOOTER = """
+
+---
+
+## Technical Analysis Details
+
+**Analysis Framework:** Direct file reading with LlamaIndex LLM
+**Model:** Gemini 2.5 Flash
+**Temperature:** 0.1 (focused analysis)
+**Source Files:** Gemini AI security analysis + Prowler vulnerability scan
+
+*This report consolidates findings from automated security analysis tools and should be reviewed by qualified security professionals.*
+"""
+
+# Independent report sections, generated concurrently and assembled in this
+# order. Splitting the monolithic prompt sidesteps the 8000-output-token cap
+# and lets the four generations overlap on the wire.
+SECTION_PROMPTS = {
+    "Executive Summary": """## Executive Summary
 - Overall security posture rating (CRITICAL/HIGH/MEDIUM/LOW)
 - Total vulnerability count by severity
 - Top 5 most critical issues requiring immediate attention
-- Business impact assessment
-
-## Critical Findings Correlation
+- Business impact assessment""",
+    "Critical Findings Correlation": """## Critical Findings Correlation
 - Issues confirmed by BOTH tools (highest confidence)
 - Unique findings from each tool
-- Priority vulnerabilities requiring immediate action
-
-## Risk Prioritization
+- Priority vulnerabilities requiring immediate action""",
+    "Risk Prioritization": """## Risk Prioritization
 - CRITICAL (P0): Immediate remediation (0-24 hours)
-- HIGH (P1): Priority remediation (1-7 days) 
+- HIGH (P1): Priority remediation (1-7 days)
 - MEDIUM (P2): Planned remediation (1-30 days)
-- LOW (P3): Strategic improvements (30+ days)
-
-## Remediation Roadmap
+- LOW (P3): Strategic improvements (30+ days)""",
+    "Remediation Roadmap": """## Remediation Roadmap
 - Step-by-step fixes for critical and high-risk issues
 - Terraform code corrections where applicable
-- Implementation timeline
+- Implementation timeline""",
+}
+
+# Pre-encoded static prompt segments; per-run prompt assembly is then a
+# single bytes join per section instead of re-scanning the large static
+# skeleton through f-string formatting on every call
+CONTEXT_PREFIX_BYTES = b"""
+You are a senior cybersecurity consultant. Analyze the provided Gemini AI security analysis and Prowler vulnerability scan findings to create a concise executive-level security consolidation report.
 
-Format as professional Markdown suitable for executive review. Keep concise but comprehensive.
+GEMINI AI SECURITY ANALYSIS:
 """
-        
-        print("DEBUG: Generating consolidation analysis...")
-        
-        # Generate the consolidation report
-        response = llm.complete(consolidation_prompt)
-        consolidation_report = response.text if hasattr(response, 'text') else str(response)
-        
-        print(f"DEBUG: Consolidation completed - response length: {len(consolidation_report)} characters")
-        
-        # Create final report with metadata
-        final_report = f"""# Cloud Security Consolidation Analysis Report
 
-**Project:** inbound-entity-461511-j4  
-**Analysis Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  
-**Analysis Method:** Direct File Analysis + LlamaIndex LLM  
-**Report Classification:** CONFIDENTIAL - Internal Security Assessment  
+CONTEXT_MIDDLE_BYTES = b"""
 
----
+PROWLER VULNERABILITY FINDINGS:
+"""
 
-{consolidation_report}
+SECTION_SUFFIX_BYTES = {
+    name: f"""
 
----
+Write ONLY the following section of the consolidation report:
 
-## Technical Analysis Details
+{spec}
 
-**Analysis Framework:** Direct file reading with LlamaIndex LLM  
-**Model:** Gemini 2.5 Flash  
-**Temperature:** 0.1 (focused analysis)  
-**Source Files:** Gemini AI security analysis + Prowler vulnerability scan  
+Format as professional Markdown suitable for executive review. Keep concise but comprehensive. Start directly with the section heading shown above.
+""".encode('utf-8')
+    for name, spec in SECTION_PROMPTS.items()
+}
 
-*This report consolidates findings from automated security analysis tools and should be reviewed by qualified security professionals.*
-"""
+def build_context_bytes(gemini_content, prowler_content):
+    """Assemble the shared context block from pre-encoded segments."""
+    return b''.join([
+        CONTEXT_PREFIX_BYTES,
+        gemini_content.encode('utf-8'),
+        CONTEXT_MIDDLE_BYTES,
+        prowler_content.encode('utf-8'),
+    ])
+
+async def generate_sections(llm, context_bytes):
+    """Fan the section prompts out with asyncio.gather and acomplete."""
+    async def run_section(name, suffix_bytes):
+        prompt = b''.join([context_bytes, suffix_bytes]).decode('utf-8', errors='replace')
+        cache_key = llm_cache_key(llm.model, prompt)
+        cached = LLM_CACHE.get(cache_key)
+        if cached is not None:
+            log.debug(f"LLM cache hit for section: {name}")
+            return name, cached
+        response = await llm.acomplete(prompt)
+        LLM_CACHE.set(cache_key, response.text)
+        return name, response.text
+
+    results = await asyncio.gather(
+        *(run_section(name, suffix) for name, suffix in SECTION_SUFFIX_BYTES.items())
+    )
+    return dict(results)
+
+def filter_prowler_findings(prowler_file):
+    """Slim the Prowler OCSF JSON to failing findings before prompting.
+
+    The raw scan output is mostly PASS records and verbose resource
+    metadata; the consolidation only needs the FAIL/NEW findings with
+    title, severity, affected resources and remediation. ijson streams
+    the top-level array so peak memory holds only the retained records,
+    never the full multi-MB file.
+    """
+    import ijson
+
+    slim = []
+    total = 0
+    with open(prowler_file, 'rb') as f:
+        # ijson's 'item' stream only understands a top-level array; a
+        # dict-shaped export would silently yield zero findings. Sniff the
+        # first token and pass any other shape through untouched.
+        head = f.read(64)
+        f.seek(0)
+        if not head.lstrip().startswith(b'['):
+            records = orjson.loads(f.read())
+            log.debug("Prowler results are not a top-level array - passing through unfiltered")
+            return records if isinstance(records, list) else [records]
+        for record in ijson.items(f, 'item'):
+            total += 1
+            if record.get('status_code') not in ('FAIL', 'NEW'):
+                continue
+            slim.append({
+                'check_id': record.get('unmapped', {}).get('check_id'),
+                'title': record.get('finding_info', {}).get('title'),
+                'severity': record.get('severity'),
+                'status_code': record.get('status_code'),
+                'resources': [r.get('uid') for r in record.get('resources', [])],
+                'remediation': record.get('remediation', {}).get('desc'),
+            })
+
+    log.debug(f"Filtered Prowler findings: {len(slim)} failing of {total} total")
+    return slim
+
+def fit_to_token_budget(gemini_content, findings):
+    """Trim the prompt payload to fit the model context window.
+
+    Oversized prompts fail with a context error and force a retry, which
+    dominates latency on large scans. Low-severity Prowler findings are
+    dropped first; only if that is not enough is the Gemini analysis
+    head-truncated proportionally.
+    """
+    counter = TokenCounter()
+    gem_tok = counter.get_string_tokens(gemini_content)
+    prowler_json = orjson.dumps(findings, option=orjson.OPT_INDENT_2).decode()
+    pro_tok = counter.get_string_tokens(prowler_json)
+
+    if gem_tok + pro_tok <= TOKEN_BUDGET:
+        return gemini_content, prowler_json
+
+    log.debug(f"Prompt over budget ({gem_tok + pro_tok:,} tokens) - trimming...")
+    for severity in ('informational', 'low'):
+        findings = [f for f in findings
+                    if (f.get('severity') or '').lower() != severity]
+        prowler_json = orjson.dumps(findings, option=orjson.OPT_INDENT_2).decode()
+        pro_tok = counter.get_string_tokens(prowler_json)
+        if gem_tok + pro_tok <= TOKEN_BUDGET:
+            log.debug(f"Dropped {severity}-severity findings to fit budget")
+            return gemini_content, prowler_json
+
+    # Still over budget - keep the head of the Gemini analysis that fits
+    available = max(TOKEN_BUDGET - pro_tok, 0)
+    keep_chars = int(len(gemini_content) * available / gem_tok)
+    gemini_content = gemini_content[:keep_chars]
+    log.debug(f"Truncated Gemini analysis to ~{available:,} tokens")
+    return gemini_content, prowler_json
+
+def main():
+    if len(sys.argv) != 4:
+        print("Usage: python3 script.py <gemini_file> <prowler_file> <output_file>")
+        sys.exit(1)
+    
+    gemini_file = sys.argv[1]
+    prowler_file = sys.argv[2]
+    output_file = sys.argv[3]
+    
+    log.debug("Starting simple consolidation analysis...")
+    log.debug(f"Gemini file: {gemini_file}")
+    log.debug(f"Prowler file: {prowler_file}")
+    log.debug(f"Output file: {output_file}")
+    
+    try:
+        # Overlap the two file reads with LLM client setup - all three are
+        # independent, and the Prowler parse can take seconds on large scans
+        log.debug("Reading input files and warming up LLM client...")
+        with ThreadPoolExecutor(max_workers=3) as ex:
+            fut_gemini = ex.submit(Path(gemini_file).read_text, encoding='utf-8')
+            fut_prowler = ex.submit(filter_prowler_findings, prowler_file)
+            fut_llm = ex.submit(get_llm)
+            gemini_content = fut_gemini.result()
+            prowler_findings = fut_prowler.result()
+            llm = fut_llm.result()
+
+        # Trim to the context budget before any LLM call is attempted
+        gemini_content, prowler_content = fit_to_token_budget(
+            gemini_content, prowler_findings
+        )
         
-        # Write to output file
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(final_report)
+        log.debug(f"Gemini analysis length: {len(gemini_content)} characters")
+        log.debug(f"Prowler findings length: {len(prowler_content)} characters")
         
-        print(f"✅ Consolidation analysis completed successfully!")
-        print(f"📁 Report saved to: {output_file}")
-        print(f"📊 Report size: {len(final_report):,} characters")
+        # Shared context prefixed to every section prompt
+        context_bytes = build_context_bytes(gemini_content, prowler_content)
+
+        log.debug("Generating consolidation analysis...")
+        log.debug(f"Running {len(SECTION_PROMPTS)} section queries concurrently...")
+
+        sections = asyncio.run(generate_sections(llm, context_bytes))
+
+        report_header = REPORT_HEADER.format(
+            date=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        )
+
+        # Write sections to disk in fixed order through a 1 MiB buffer, so
+        # no intermediate full-report string is ever assembled
+        report_size = len(report_header) + len(REPORT_FOOTER)
+        with open(output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.write(report_header)
+            for name in SECTION_PROMPTS:
+                section_text = sections[name]
+                f.write(section_text)
+                f.write("\n\n")
+                report_size += len(section_text) + 2
+            f.write(REPORT_FOOTER)
+
+        log.info(f"Consolidation analysis completed successfully!")
+        log.info(f"Report saved to: {output_file}")
+        log.info(f"Report size: {report_size:,} characters")
         
     except Exception as e:
-        print(f"❌ ERROR: Consolidation analysis failed: {e}")
+        log.error(f"Consolidation analysis failed: {e}")
         import traceback
         traceback.print_exc()
         sys.exit(1)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "WARNING"))
     main()
\ No newline at end of file
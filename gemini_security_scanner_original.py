@@ -5,15 +5,25 @@ Uses non-deprecated LlamaIndex APIs (2025) and API key from UI
 """
 
 import os
+import re
 import sys
 import json
 import asyncio
+import hashlib
+import logging
+import pickle
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
 
 # Modern LlamaIndex imports (non-deprecated)
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, Settings
+from llama_index.core import (
+    SimpleDirectoryReader,
+    StorageContext,
+    VectorStoreIndex,
+    Settings,
+    load_index_from_storage,
+)
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.retrievers import VectorIndexRetriever
@@ -21,6 +31,76 @@ from llama_index.core.response_synthesizers import get_response_synthesizer
 from llama_index.core.response_synthesizers.type import ResponseMode
 from llama_index.llms.google_genai import GoogleGenAI
 from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+from llama_index.vector_stores.faiss import FaissVectorStore
+from diskcache import Cache
+import faiss
+
+log = logging.getLogger(__name__)
+
+# text-embedding-004 vector dimensionality
+_EMBED_DIM = 768
+
+# Shared analysis context prefixed to every section query, built once at
+# import instead of per call
+_PROMPT_PREAMBLE = """You are a senior cybersecurity expert specializing in cloud infrastructure security analysis.
+
+Analyze the provided Terraform configurations for security vulnerabilities.
+
+**CRITICAL INSTRUCTIONS:**
+1. Focus on identifying ACTUAL security vulnerabilities, not just listing configurations
+2. Provide specific severity ratings (CRITICAL, HIGH, MEDIUM, LOW)
+3. Include configuration evidence for each finding
+4. Provide actionable remediation steps with code examples
+
+**ANALYSIS FOCUS AREAS:**
+- Overly permissive firewall/security group rules (0.0.0.0/0 access)
+- Missing encryption configurations (at-rest and in-transit)
+- Inadequate IAM permissions and service account configurations
+- Public resource exposure (storage buckets, databases)
+- Weak access controls and authentication
+- Missing logging and monitoring configurations
+- Default/weak network security configurations
+- Credential management issues
+
+Write ONLY the following section of the security assessment report, in
+professional Markdown suitable for executive review, starting directly
+with the section heading shown:
+
+"""
+
+# Independent report sections, queried concurrently and assembled in this
+# order. Each call stays far below the 32k output budget, so the wall
+# time of synthesis approaches the slowest single section instead of the
+# sum of all of them.
+_SECTION_PROMPTS = {
+    "Executive Summary": """## Executive Summary
+- Overall security posture rating (CRITICAL/HIGH/MEDIUM/LOW)
+- Total number of findings by severity
+- Critical issues requiring immediate action
+- Business impact assessment""",
+    "Critical Vulnerabilities": """## Critical Vulnerabilities (CRITICAL)
+For each critical finding:
+- **Vulnerability:** Brief title
+- **Severity:** CRITICAL
+- **Description:** Detailed explanation
+- **Evidence:** Specific configuration snippets
+- **Impact:** Potential business/security impact
+- **Remediation:** Step-by-step fix with code""",
+    "High-Risk Issues": """## High-Risk Issues (HIGH)
+[Same format as the critical section, for HIGH severity findings]""",
+    "Medium-Risk Issues": """## Medium-Risk Issues (MEDIUM)
+[Same format as the critical section, for MEDIUM severity findings]""",
+    "Low-Risk Issues": """## Low-Risk Issues (LOW)
+[Same format as the critical section, for LOW severity findings]""",
+    "Compliance & Best Practices": """## Compliance & Best Practices
+- Industry standard compliance gaps
+- Security best practice recommendations
+- Long-term security improvements""",
+    "Implementation Roadmap": """## Implementation Roadmap
+- Priority order for fixes (P0: 0-24hrs, P1: 1-7days, P2: 1-30days)
+- Resource requirements
+- Implementation timeline""",
+}
 
 
 class ModernGeminiSecurityScanner:
@@ -45,47 +125,141 @@ class ModernGeminiSecurityScanner:
         self.embed_config = {
             "model_name": "text-embedding-004",
             "api_key": self.api_key,
-            "embed_batch_size": 10
+            "embed_batch_size": 100  # API max; fewer round-trips per corpus
         }
         
-        # Configure node parser for better chunking
+        # Persisted vector indexes, keyed by corpus content hash; an
+        # unchanged Terraform tree is re-scanned without any embedding calls
+        self.index_cache_dir = Path("./.scan_cache")
+
+        # Synthesized responses, keyed by (index hash, prompt hash); a
+        # repeat run with the same prompt and corpus skips retrieval and
+        # LLM synthesis entirely
+        self._query_cache = Cache(str(self.index_cache_dir / "queries"))
+
+        # Configure node parser for better chunking. Terraform is terse
+        # HCL, so larger chunks with slim overlap halve the chunk count,
+        # and a whitespace length function skips the default GPT-2
+        # tokenizer (expensive and not Gemini's tokenization anyway).
         Settings.node_parser = SentenceSplitter(
-            chunk_size=1024,
-            chunk_overlap=200
+            chunk_size=2048,
+            chunk_overlap=64,
+            tokenizer=str.split
         )
+
+    def _corpus_hash(self) -> str:
+        """Fingerprint the Terraform tree from file paths, mtimes and sizes"""
+        entries = sorted(
+            (str(path), path.stat().st_mtime_ns, path.stat().st_size)
+            for ext in (".tf", ".txt")
+            for path in self.terraform_dir.rglob(f"*{ext}")
+        )
+        return hashlib.sha256(repr(entries).encode()).hexdigest()
     
     def load_terraform_documents(self) -> List:
         """Load and parse Terraform documents"""
-        print("🔍 Loading Terraform documents...")
+        log.info("Loading Terraform documents...")
         
         if not self.terraform_dir.exists():
             raise FileNotFoundError(f"Terraform directory not found: {self.terraform_dir}")
-        
+
+        # Parsed documents are pickled per corpus fingerprint, so an
+        # unchanged tree skips the re-read and Document reconstruction
+        docs_cache = self.index_cache_dir / f"docs_{self._corpus_hash()}.pkl"
+        if docs_cache.exists():
+            with open(docs_cache, 'rb') as f:
+                documents = pickle.load(f)
+            log.info(f"Loaded {len(documents)} documents (cached)")
+            return documents
+
         # Load documents with proper extensions
         reader = SimpleDirectoryReader(
             input_dir=str(self.terraform_dir),
             required_exts=[".txt", ".tf"],
             recursive=True
         )
-        
+
         documents = reader.load_data()
-        
+
         if not documents:
             raise ValueError(f"No Terraform documents found in {self.terraform_dir}")
-        
-        print(f"📄 Loaded {len(documents)} documents")
+
+        self.index_cache_dir.mkdir(exist_ok=True)
+        with open(docs_cache, 'wb') as f:
+            pickle.dump(documents, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        log.info(f"Loaded {len(documents)} documents")
         return documents
     
+    # Matches blank lines and HCL comment lines (# or //)
+    _COMMENT_ONLY_RE = re.compile(r"^\s*(?:[#/].*)?$")
+
+    def _prepare_unique_nodes(self, documents: List) -> List:
+        """Chunk documents and embed each distinct chunk text only once
+
+        Multi-module Terraform trees repeat provider blocks and variable
+        definitions verbatim; byte-identical chunks reuse the
+        representative chunk's embedding instead of paying another API
+        call. Comment-only chunks are dropped outright.
+        """
+        nodes = [
+            node for node in Settings.node_parser.get_nodes_from_documents(documents)
+            if not all(self._COMMENT_ONLY_RE.match(line) for line in node.text.splitlines())
+        ]
+
+        by_hash = {}
+        for node in nodes:
+            key = hashlib.blake2b(node.text.encode(), digest_size=16).digest()
+            by_hash.setdefault(key, []).append(node)
+
+        groups = list(by_hash.values())
+        log.info(f"Embedding {len(groups)} unique chunks "
+                 f"({len(nodes) - len(groups)} duplicates reuse an embedding)")
+        embeddings = Settings.embed_model.get_text_embedding_batch(
+            [group[0].text for group in groups], show_progress=True
+        )
+        for group, embedding in zip(groups, embeddings):
+            for node in group:
+                node.embedding = embedding
+        return nodes
+
     def create_security_rag_pipeline(self, documents: List) -> RetrieverQueryEngine:
         """Create modern RAG pipeline for security analysis"""
-        print("🔧 Building RAG pipeline...")
+        log.info("Building RAG pipeline...")
         
         # Initialize LlamaIndex settings now (when actually needed)
         Settings.llm = GoogleGenAI(**self.llm_config)
         Settings.embed_model = GoogleGenAIEmbedding(**self.embed_config)
         
-        # Create vector index
-        index = VectorStoreIndex.from_documents(documents)
+        # Reuse a persisted index when the Terraform tree is unchanged;
+        # otherwise build it and persist for the next run
+        self._index_hash = self._corpus_hash()
+        persist_dir = self.index_cache_dir / self._index_hash
+        if (persist_dir / "docstore.json").exists():
+            log.info("Reusing cached vector index (corpus unchanged)")
+            vector_store = FaissVectorStore.from_persist_dir(str(persist_dir))
+            storage_context = StorageContext.from_defaults(
+                vector_store=vector_store, persist_dir=str(persist_dir)
+            )
+            index = load_index_from_storage(storage_context)
+        else:
+            # Exact inner-product search in FAISS's SIMD C kernels over a
+            # contiguous float32 matrix, instead of the default store's
+            # per-vector Python loop
+            vector_store = FaissVectorStore(faiss_index=faiss.IndexFlatIP(_EMBED_DIM))
+            storage_context = StorageContext.from_defaults(vector_store=vector_store)
+
+            # Create vector index from deduplicated, pre-embedded nodes;
+            # async ingestion keeps any remaining embedding batches
+            # concurrent instead of one blocking HTTP call per batch
+            index = VectorStoreIndex(
+                nodes=self._prepare_unique_nodes(documents),
+                storage_context=storage_context,
+                use_async=True,
+                show_progress=True,
+                insert_batch_size=2048
+            )
+            index.storage_context.persist(persist_dir=str(persist_dir))
         
         # Configure retriever with similarity search
         retriever = VectorIndexRetriever(
@@ -93,10 +267,13 @@ class ModernGeminiSecurityScanner:
             similarity_top_k=10
         )
         
-        # Configure response synthesizer for security analysis
+        # Configure response synthesizer for security analysis. COMPACT
+        # stuffs the retrieved context into as few LLM calls as possible
+        # (usually one, given the 32k output budget) where TREE_SUMMARIZE
+        # recursed over the chunks with an LLM call per level.
         response_synthesizer = get_response_synthesizer(
-            response_mode=ResponseMode.TREE_SUMMARIZE,
-            streaming=False
+            response_mode=ResponseMode.COMPACT,
+            streaming=True
         )
         
         # Create query engine
@@ -105,75 +282,39 @@ class ModernGeminiSecurityScanner:
             response_synthesizer=response_synthesizer
         )
         
-        print("✅ RAG pipeline ready")
+        log.info("RAG pipeline ready")
         return query_engine
     
-    def generate_security_analysis_prompt(self) -> str:
-        """Generate comprehensive security analysis prompt"""
-        return """You are a senior cybersecurity expert specializing in cloud infrastructure security analysis. 
-
-Analyze the provided Terraform configurations for security vulnerabilities and provide a comprehensive security assessment report.
-
-**CRITICAL INSTRUCTIONS:**
-1. Focus on identifying ACTUAL security vulnerabilities, not just listing configurations
-2. Provide specific severity ratings (CRITICAL, HIGH, MEDIUM, LOW)
-3. Include configuration evidence for each finding
-4. Provide actionable remediation steps with code examples
-
-**ANALYSIS FOCUS AREAS:**
-- Overly permissive firewall/security group rules (0.0.0.0/0 access)
-- Missing encryption configurations (at-rest and in-transit)
-- Inadequate IAM permissions and service account configurations
-- Public resource exposure (storage buckets, databases)
-- Weak access controls and authentication
-- Missing logging and monitoring configurations
-- Default/weak network security configurations
-- Credential management issues
-
-**REQUIRED REPORT STRUCTURE:**
+    async def _query_section(self, query_engine, prompt: str,
+                             sem: asyncio.Semaphore) -> str:
+        """Run one section query under the concurrency cap, with caching"""
+        cache_key = hashlib.sha256(
+            (self._index_hash + prompt).encode()
+        ).hexdigest()
+        cached = self._query_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-## Executive Summary
-- Overall security posture rating (CRITICAL/HIGH/MEDIUM/LOW)
-- Total number of findings by severity
-- Critical issues requiring immediate action
-- Business impact assessment
+        async with sem:
+            response = await query_engine.aquery(prompt)
+            text = "".join([token async for token in response.async_response_gen()])
+        self._query_cache.set(cache_key, text)
+        return text
 
-## Critical Vulnerabilities (CRITICAL)
-For each critical finding:
-- **Vulnerability:** Brief title
-- **Severity:** CRITICAL
-- **Description:** Detailed explanation
-- **Evidence:** Specific configuration snippets
-- **Impact:** Potential business/security impact
-- **Remediation:** Step-by-step fix with code
-
-## High-Risk Issues (HIGH)
-[Same format as critical]
-
-## Medium-Risk Issues (MEDIUM)
-[Same format as critical]
-
-## Low-Risk Issues (LOW)
-[Same format as critical]
-
-## Compliance & Best Practices
-- Industry standard compliance gaps
-- Security best practice recommendations
-- Long-term security improvements
-
-## Implementation Roadmap
-- Priority order for fixes (P0: 0-24hrs, P1: 1-7days, P2: 1-30days)
-- Resource requirements
-- Implementation timeline
-
-Provide a thorough, professional security assessment suitable for executive review."""
+    async def _query_sections(self, query_engine) -> List[str]:
+        """Fan the per-section queries out with at most four in flight"""
+        sem = asyncio.Semaphore(4)
+        return await asyncio.gather(*(
+            self._query_section(query_engine, _PROMPT_PREAMBLE + spec, sem)
+            for spec in _SECTION_PROMPTS.values()
+        ))
 
     async def run_security_analysis(self) -> str:
         """Run comprehensive security analysis using RAG pipeline"""
         try:
-            print("🚀 Starting Gemini security analysis...")
-            print(f"📂 Project: {self.project_id}")
-            print(f"📁 Terraform directory: {self.terraform_dir}")
+            log.info("Starting Gemini security analysis...")
+            log.info(f"Project: {self.project_id}")
+            log.info(f"Terraform directory: {self.terraform_dir}")
             
             # Load documents
             documents = self.load_terraform_documents()
@@ -181,14 +322,13 @@ Provide a thorough, professional security assessment suitable for executive revi
             # Create RAG pipeline
             query_engine = self.create_security_rag_pipeline(documents)
             
-            # Generate security analysis
-            print("🔍 Running security vulnerability analysis...")
-            security_prompt = self.generate_security_analysis_prompt()
+            # Generate security analysis, one concurrent query per section
+            log.info("Running security vulnerability analysis...")
+            log.info(f"Querying {len(_SECTION_PROMPTS)} report sections concurrently...")
+            sections = await self._query_sections(query_engine)
             
-            response = query_engine.query(security_prompt)
-            
-            # Create comprehensive report
-            report = f"""# Terraform Security Analysis Report
+            # Static report skeleton around the section bodies
+            report_header = f"""# Terraform Security Analysis Report
 
 **Project:** {self.project_id}
 **Analysis Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
@@ -198,7 +338,8 @@ Provide a thorough, professional security assessment suitable for executive revi
 
 ---
 
-{response.response}
+"""
+            report_footer = f"""
 
 ---
 
@@ -213,19 +354,25 @@ Provide a thorough, professional security assessment suitable for executive revi
 
 *This report was generated using advanced AI security analysis. All findings should be validated by qualified security professionals before implementation.*
 """
-            
-            # Save report
-            with open(self.output_file, 'w', encoding='utf-8') as f:
-                f.write(report)
-            
-            print(f"✅ Security analysis completed successfully!")
-            print(f"📄 Report saved to: {self.output_file}")
-            print(f"📊 Report size: {len(report):,} characters")
+
+            # Write sections to disk in fixed order through a 1 MiB buffer,
+            # so no intermediate full-report string is ever assembled
+            report_size = 0
+            with open(self.output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                report_size += f.write(report_header)
+                for section_text in sections:
+                    report_size += f.write(section_text)
+                    report_size += f.write("\n\n")
+                report_size += f.write(report_footer)
+
+            log.info("Security analysis completed successfully!")
+            log.info(f"Report saved to: {self.output_file}")
+            log.info(f"Report size: {report_size:,} characters")
             
             return self.output_file
             
         except Exception as e:
-            print(f"❌ Security analysis failed: {e}")
+            log.error(f"Security analysis failed: {e}")
             import traceback
             traceback.print_exc()
             raise
@@ -274,4 +421,10 @@ def main():
 
 
 if __name__ == "__main__":
+    # Buffered logging with a single-character level prefix; avoids the
+    # per-call stdout flush and multi-byte emoji encoding of bare print
+    logging.basicConfig(
+        level=os.environ.get("LOGLEVEL", "INFO"),
+        format="%(levelname).1s %(message)s",
+    )
     main()
\ No newline at end of file
@@ -6,9 +6,18 @@ Uses one-shot LLM analysis (not RAG) for complete context awareness
 """
 
 import os
+import re
 import sys
 import json
+import random
 import asyncio
+
+# C JSON parser/serializer; multi-MB Prowler reports parse several times
+# faster than with stdlib json. Falls back to stdlib when unavailable.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Any, Optional
@@ -16,6 +25,10 @@ from typing import List, Dict, Any, Optional
 # Modern LlamaIndex imports for direct LLM completion
 from llama_index.llms.google_genai import GoogleGenAI
 
+# Shared cap on in-flight Gemini requests; keeps concurrent completions
+# under the per-minute quota so bursts don't trigger 429 storms
+_LLM_SEMAPHORE = asyncio.Semaphore(int(os.getenv("GEMINI_CONCURRENCY", "4")))
+
 
 class SecurityConsolidator:
     """
@@ -36,84 +49,120 @@ class SecurityConsolidator:
             temperature=0.1
         )
     
+    async def _rate_limited_complete(self, prompt: str):
+        """Run an LLM completion under the shared concurrency cap
+
+        The short random delay de-synchronizes calls issued in the same
+        tick, spreading them across the rate window instead of landing
+        as one burst.
+        """
+        async with _LLM_SEMAPHORE:
+            await asyncio.sleep(random.uniform(0.05, 0.2))
+            return await self.llm.acomplete(prompt)
+
     def _truncate_text(self, text: str, max_chars: int) -> str:
         """Truncate text to maximum characters to prevent token limit issues"""
         if len(text) <= max_chars:
             return text
-        
-        truncated = text[:max_chars]
-        # Try to cut at a reasonable boundary
-        last_newline = truncated.rfind('\n')
-        if last_newline > max_chars * 0.8:  # If we can find a newline in the last 20%
-            truncated = truncated[:last_newline]
-        
-        return truncated + f"\n\n... [TRUNCATED - Original length: {len(text)} chars, showing first {len(truncated)} chars]"
+
+        # Cut at a newline in the last 20% when one exists; rfind with
+        # start/end offsets searches the original string in place, so no
+        # intermediate max_chars-sized copy is allocated just to scan it
+        cut = text.rfind('\n', int(max_chars * 0.8), max_chars)
+        if cut == -1:
+            cut = max_chars
+
+        return text[:cut] + f"\n\n... [TRUNCATED - Original length: {len(text)} chars, showing first {cut} chars]"
     
+    # Compiled filename filters covering all former glob patterns; each
+    # finder now walks the results tree exactly once instead of running
+    # several overlapping recursive globs
+    _PROWLER_NAME_RE = re.compile(r".*prowler.*\.json$")
+    _GEMINI_NAME_RE = re.compile(r"(?:.*security_analysis.*|.*gemini.*(?:analysis|security).*)\.txt$")
+
+    def _find_most_recent(self, name_re: "re.Pattern") -> Optional[str]:
+        """Single os.scandir walk returning the newest matching file
+
+        scandir surfaces type and stat information from the dirent, so the
+        whole search costs one syscall per entry instead of the extra
+        stat per candidate that a glob-then-max pass pays.
+        """
+        best_path = None
+        best_mtime = -1.0
+        stack = [str(self.results_dir)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and name_re.match(entry.name):
+                            mtime = entry.stat().st_mtime
+                            if mtime > best_mtime:
+                                best_mtime = mtime
+                                best_path = entry.path
+            except OSError:
+                continue
+        return best_path
+
+    def _truncate_findings_json(self, data: List[Any], max_chars: int) -> str:
+        """Serialize only the findings prefix that fits the character budget
+
+        Serializing the entire findings list just to keep the first couple
+        thousand characters wastes CPU and memory on large scans. Estimate
+        the per-finding size from a small sample, slice the list first,
+        and serialize only that slice.
+        """
+        if not isinstance(data, list) or not data:
+            return self._truncate_text(self._dump_json(data), max_chars)
+
+        sample = data[:5]
+        avg_chars = max(1, len(self._dump_json(sample)) // len(sample))
+        keep = min(len(data), max(5, max_chars // avg_chars))
+
+        truncated = self._truncate_text(self._dump_json(data[:keep]), max_chars)
+        if keep < len(data):
+            truncated += f"\n... [{len(data) - keep} more findings omitted]"
+        return truncated
+
+    @staticmethod
+    def _dump_json(data: Any) -> str:
+        """Serialize findings with orjson when available, stdlib otherwise"""
+        if orjson:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+        return json.dumps(data, indent=2)
+
     def find_prowler_results(self) -> Optional[str]:
         """Find the most recent cleaned Prowler JSON results file"""
         print("🔍 Searching for Prowler results...")
-        
-        # Search patterns for Prowler results
-        patterns = [
-            "*prowler*cleaned*.json",
-            "*prowler*.json", 
-            "*cleaned*prowler*.json",
-            "prowler_*.json",
-            "*prowler*output*.json"
-        ]
-        
-        prowler_files = []
-        for pattern in patterns:
-            files = list(self.results_dir.glob(pattern))
-            prowler_files.extend(files)
-            # Also search in subdirectories
-            files = list(self.results_dir.glob(f"**/{pattern}"))
-            prowler_files.extend(files)
-        
-        if not prowler_files:
+
+        most_recent = self._find_most_recent(self._PROWLER_NAME_RE)
+        if not most_recent:
             print("⚠️ No Prowler results found - will proceed with Gemini results only")
             return None
-        
-        # Get the most recent file
-        most_recent = max(prowler_files, key=lambda f: f.stat().st_mtime)
+
         print(f"📄 Found Prowler results: {most_recent}")
-        return str(most_recent)
-    
+        return most_recent
+
     def find_gemini_results(self) -> Optional[str]:
         """Find the most recent enhanced Gemini analysis results file"""
         print("🔍 Searching for Gemini results...")
-        
-        # Search patterns for Gemini results (order matters - most specific first)
-        patterns = [
-            "enhanced_security_analysis_*.txt",
-            "*security_analysis*.txt", 
-            "*gemini*analysis*.txt",
-            "*gemini*security*.txt"
-        ]
-        
-        gemini_files = []
-        for pattern in patterns:
-            files = list(self.results_dir.glob(pattern))
-            gemini_files.extend(files)
-            # Also search in subdirectories
-            files = list(self.results_dir.glob(f"**/{pattern}"))
-            gemini_files.extend(files)
-        
-        if not gemini_files:
+
+        most_recent = self._find_most_recent(self._GEMINI_NAME_RE)
+        if not most_recent:
             print("❌ No Gemini results found")
             return None
-        
-        # Get the most recent file
-        most_recent = max(gemini_files, key=lambda f: f.stat().st_mtime)
+
         print(f"📄 Found Gemini results: {most_recent}")
-        return str(most_recent)
+        return most_recent
     
     def load_prowler_results(self, file_path: str) -> Dict[str, Any]:
         """Load and parse Prowler JSON results"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+            data = orjson.loads(raw) if orjson else json.loads(raw)
+
             print(f"📊 Loaded Prowler results: {len(data) if isinstance(data, list) else 'unknown count'} findings")
             return {"type": "prowler", "data": data, "file": file_path}
         
@@ -158,7 +207,7 @@ class SecurityConsolidator:
 **Priority:** MEDIUM (Verification and additional findings)
 **Content:** {len(prowler_data.get('data', [])) if prowler_data and prowler_data.get('data') else 0} findings
 ```json
-{self._truncate_text(json.dumps(prowler_data.get('data', []), indent=2) if prowler_data and prowler_data.get('data') else 'No Prowler data available', 2000)}
+{self._truncate_findings_json(prowler_data.get('data', []), 2000) if prowler_data and prowler_data.get('data') else 'No Prowler data available'}
 ```
 
 ## CONSOLIDATION REQUIREMENTS:
@@ -308,16 +357,22 @@ Focus on creating a report that is more valuable than either source alone, lever
             print(f"📂 Project: {self.project_id}")
             print(f"📁 Results directory: {self.results_dir}")
             
-            # Find and load results files
-            prowler_file = self.find_prowler_results()
-            gemini_file = self.find_gemini_results()
-            
+            # Find results files - the two directory walks overlap in threads
+            prowler_file, gemini_file = await asyncio.gather(
+                asyncio.to_thread(self.find_prowler_results),
+                asyncio.to_thread(self.find_gemini_results),
+            )
+
             if not prowler_file and not gemini_file:
                 raise ValueError("No security analysis results found to consolidate")
-            
-            # Load data
-            prowler_data = self.load_prowler_results(prowler_file) if prowler_file else None
-            gemini_data = self.load_gemini_results(gemini_file) if gemini_file else None
+
+            # Load data - JSON parse and text read overlap the same way
+            prowler_data, gemini_data = await asyncio.gather(
+                asyncio.to_thread(self.load_prowler_results, prowler_file)
+                if prowler_file else asyncio.sleep(0),
+                asyncio.to_thread(self.load_gemini_results, gemini_file)
+                if gemini_file else asyncio.sleep(0),
+            )
             
             # Create consolidation prompt
             print("🔧 Creating comprehensive consolidation prompt...")
@@ -327,7 +382,7 @@ Focus on creating a report that is more valuable than either source alone, lever
             print("🧠 Running one-shot LLM consolidation analysis...")
             print("⏳ This may take a few minutes due to the comprehensive analysis...")
             
-            response = await self.llm.acomplete(prompt)
+            response = await self._rate_limited_complete(prompt)
             
             # Create final report
             final_report = f"""# 🛡️ Final Consolidated Security Assessment
@@ -4,101 +4,262 @@ Test Enhanced Gemini Security Scanner
 Demonstrates vulnerability detection capabilities on the gcpgoat main.tf file
 """
 
+import os
 import re
+import sys
+import mmap
+import bisect
+import functools
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from enhanced_gemini_security_scanner import EnhancedGeminiSecurityScanner
+
+import numpy as np
+from dataclasses import dataclass
+from gemini_security_scanner import ModernGeminiSecurityScanner
+
+
+@dataclass(frozen=True, slots=True)
+class Finding:
+    """One detected vulnerability pattern with its evidence
+
+    Slotted records cost a fraction of a dict per finding and make the
+    display loop attribute lookups C slot reads instead of hash probes.
+    """
+    category: str
+    severity: str
+    vulnerability: str
+    pattern: str
+    match_count: int
+    line_matches: list
+    remediation: str
+
+# Optional linear-time regex engine (pip install google-re2). RE2 runs the
+# combined alternation as a DFA with no backtracking, so worst-case time
+# stays linear in the file size; stdlib re is the drop-in fallback.
+try:
+    import re2 as _regex_engine
+except ImportError:
+    _regex_engine = re
+
+
+@functools.lru_cache(maxsize=4)
+def _get_scanner(project_id: str, terraform_dir: str, api_key: str):
+    """Reuse one scanner per argument set across repeated analyses
+
+    Construction wires up parser settings and caches; repeat scans in
+    the same process should not pay that again.
+    """
+    return ModernGeminiSecurityScanner(project_id, terraform_dir, api_key)
+
+
+# Regex metacharacters that end a literal fragment of a pattern
+_META_SPLIT_RE = re.compile(r"[\\.^$*+?()\[\]{}|]")
+
+
+def _literal_anchor(pattern: str):
+    """Longest literal fragment a pattern cannot match without, if any
+
+    Patterns with top-level alternation have no single required fragment,
+    and fragments shorter than four bytes prefilter too weakly to bother.
+    """
+    if "|" in pattern:
+        return None
+    best = max(_META_SPLIT_RE.split(pattern), key=len)
+    return best.lower().encode('utf-8') if len(best) >= 4 else None
+
+
+@functools.lru_cache(maxsize=1)
+def _pattern_anchors(knowledge):
+    return tuple(_literal_anchor(info.regex.pattern) for info in knowledge)
+
+
+@functools.lru_cache(maxsize=8)
+def _combined_security_regex(knowledge, active):
+    """Union the given knowledge-base patterns into one alternation regex
+
+    One combined automaton streams the file through the regex engine a
+    single time instead of once per pattern; the named group p<i> of the
+    branch that fired indexes back into the knowledge tuple. Compiled in
+    bytes mode: Terraform is ASCII in practice, and scanning the raw
+    bytes avoids decoding the file into a wide str representation.
+    """
+    # The union needs only the flags its member patterns were compiled
+    # with; most drop MULTILINE (no anchors), keeping the engine's
+    # per-character step cheaper
+    flags = 0
+    for i in active:
+        flags |= knowledge[i].regex.flags & (re.IGNORECASE | re.MULTILINE)
+    return _regex_engine.compile(
+        b"|".join(
+            b"(?P<p%d>%s)" % (i, knowledge[i].regex.pattern.encode('utf-8'))
+            for i in active
+        ),
+        flags,
+    )
 
 def analyze_terraform_vulnerabilities(terraform_file: str):
     """Analyze Terraform file for known vulnerability patterns"""
-    
-    print("🔍 Enhanced Security Scanner - Vulnerability Detection Demo")
-    print("=" * 60)
+
+    # Findings output is accumulated and emitted with one stdout write at
+    # the end, instead of a lock-acquire-and-flush per print call
+    buf = []
+
+    def out(line=""):
+        buf.append(line)
+        buf.append("\n")
+    out("🔍 Enhanced Security Scanner - Vulnerability Detection Demo")
+    out("=" * 60)
     
     # Initialize scanner to get security knowledge base
-    scanner = EnhancedGeminiSecurityScanner("gcpgoat-demo", ".", "demo_key")
-    
-    # Read the Terraform file
-    with open(terraform_file, 'r') as f:
-        terraform_content = f.read()
-    
-    print(f"📄 Analyzing: {terraform_file}")
-    print(f"📊 File size: {len(terraform_content):,} characters")
-    print(f"📚 Security patterns: {len(scanner.security_knowledge)} vulnerability types")
-    print()
+    scanner = _get_scanner("gcpgoat-demo", ".", "demo_key")
     
     findings = []
-    
-    # Check each security pattern against the Terraform content
-    for pattern_info in scanner.security_knowledge:
-        pattern = pattern_info['pattern']
-        category = pattern_info['category']
-        severity = pattern_info['severity']
-        vulnerability = pattern_info['vulnerability']
-        
-        # Use regex to find matches
-        try:
-            matches = re.findall(pattern, terraform_content, re.IGNORECASE | re.MULTILINE)
-            if matches:
-                # Find line numbers for context
-                lines = terraform_content.split('\n')
+    by_severity = defaultdict(list)
+
+    file_size = os.path.getsize(terraform_file)
+    out(f"📄 Analyzing: {terraform_file}")
+    out(f"📊 File size: {file_size:,} bytes")
+    out(f"📚 Security patterns: {len(scanner.security_knowledge)} vulnerability types")
+    out()
+
+    # Memory-map the file instead of reading it: the page cache backs the
+    # scan (repeat runs stay warm), only the mapped bytes are resident, and
+    # just the few evidence lines shown are ever decoded to str. mmap
+    # refuses zero-byte files, and an empty config trivially has no
+    # findings, so the scan is skipped and the report below stays empty.
+    if file_size > 0:
+        with open(terraform_file, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Literal prefilter: one memchr-speed substring pass per anchor
+            # decides which patterns can possibly fire, and the combined
+            # regex is built from just those survivors
+            anchors = _pattern_anchors(scanner.security_knowledge)
+            lowered = bytes(mm).lower()
+            active = tuple(
+                i for i, anchor in enumerate(anchors)
+                if anchor is None or anchor in lowered
+            )
+
+            # Scan the surviving patterns in a single combined pass over the
+            # file. Only a hit counter and the first 3 offsets are kept per
+            # pattern - all the display ever shows - so a pattern that fires
+            # thousands of times costs O(1) memory, not O(matches).
+            hits = {}
+            if active:
+                combined = _combined_security_regex(scanner.security_knowledge, active)
+                for match in combined.finditer(mm):
+                    bucket = hits.setdefault(int(match.lastgroup[1:]), [0, []])
+                    bucket[0] += 1
+                    if len(bucket[1]) < 3:
+                        bucket[1].append(match.start())
+
+            # Newline prefix array, built only when something fired: one
+            # vectorized C pass over the mapped bytes replaces a Python-level
+            # finditer loop, and bisect then maps offsets to line numbers
+            if hits:
+                byte_view = np.frombuffer(mm, dtype=np.uint8)
+                line_starts = np.concatenate(([0], np.flatnonzero(byte_view == 0x0A) + 1))
+                # frombuffer exports a pointer into the map; release it here
+                # or mm.close() at the end of the with block raises
+                # BufferError
+                del byte_view
+
+            for idx in sorted(hits):
+                pattern_info = scanner.security_knowledge[idx]
+                match_count, offsets = hits[idx]
+
+                # Resolve line numbers and evidence for the retained matches
                 line_matches = []
-                for i, line in enumerate(lines, 1):
-                    if re.search(pattern, line, re.IGNORECASE):
-                        line_matches.append((i, line.strip()))
-                
-                findings.append({
-                    'category': category,
-                    'severity': severity,
-                    'vulnerability': vulnerability,
-                    'pattern': pattern,
-                    'matches': matches,
-                    'line_matches': line_matches,
-                    'remediation': pattern_info['remediation']
-                })
-        except re.error:
-            # Handle complex regex patterns
-            continue
-    
+                for offset in offsets:
+                    lineno = bisect.bisect_right(line_starts, offset)
+                    start = int(line_starts[lineno - 1])
+                    end = mm.find(b'\n', start)
+                    if end == -1:
+                        end = len(mm)
+                    evidence = mm[start:end].strip().decode('utf-8', 'replace')
+                    line_matches.append((lineno, evidence))
+
+                findings.append(Finding(
+                    category=pattern_info.category,
+                    severity=pattern_info.severity,
+                    vulnerability=pattern_info.vulnerability,
+                    pattern=pattern_info.regex.pattern,
+                    match_count=match_count,
+                    line_matches=line_matches,
+                    remediation=pattern_info.remediation,
+                ))
+                # Bucket by severity as findings are produced, so the display
+                # and summary below never re-scan the flat list
+                by_severity[pattern_info.severity].append(findings[-1])
+
     # Display findings by severity
     severity_order = ['CRITICAL', 'HIGH', 'MEDIUM', 'LOW']
-    
+
     for severity in severity_order:
-        severity_findings = [f for f in findings if f['severity'] == severity]
+        severity_findings = by_severity[severity]
         if severity_findings:
-            print(f"\n🚨 {severity} VULNERABILITIES ({len(severity_findings)} found)")
-            print("-" * 50)
+            out(f"\n🚨 {severity} VULNERABILITIES ({len(severity_findings)} found)")
+            out("-" * 50)
             
             for i, finding in enumerate(severity_findings, 1):
-                print(f"\n[{severity}-{i:02d}] {finding['category']}")
-                print(f"Vulnerability: {finding['vulnerability']}")
-                print(f"Pattern: {finding['pattern']}")
-                
-                if finding['line_matches']:
-                    print("Evidence found at:")
-                    for line_num, line_content in finding['line_matches'][:3]:  # Show first 3 matches
-                        print(f"  Line {line_num}: {line_content}")
-                    if len(finding['line_matches']) > 3:
-                        print(f"  ... and {len(finding['line_matches'])-3} more occurrences")
-                
-                print(f"Remediation: {finding['remediation']}")
+                out(f"\n[{severity}-{i:02d}] {finding.category}")
+                out(f"Vulnerability: {finding.vulnerability}")
+                out(f"Pattern: {finding.pattern}")
+
+                if finding.line_matches:
+                    out("Evidence found at:")
+                    for line_num, line_content in finding.line_matches:  # First 3 matches
+                        out(f"  Line {line_num}: {line_content}")
+                    if finding.match_count > len(finding.line_matches):
+                        out(f"  ... and {finding.match_count - len(finding.line_matches)} more occurrences")
+
+                out(f"Remediation: {finding.remediation}")
     
     # Summary statistics
     total_findings = len(findings)
-    critical_count = len([f for f in findings if f['severity'] == 'CRITICAL'])
-    high_count = len([f for f in findings if f['severity'] == 'HIGH'])
+    critical_count = len(by_severity['CRITICAL'])
+    high_count = len(by_severity['HIGH'])
     
-    print(f"\n📊 SECURITY ANALYSIS SUMMARY")
-    print("=" * 40)
-    print(f"Total Vulnerabilities: {total_findings}")
-    print(f"Critical Issues: {critical_count}")
-    print(f"High-Risk Issues: {high_count}")
+    out(f"\n📊 SECURITY ANALYSIS SUMMARY")
+    out("=" * 40)
+    out(f"Total Vulnerabilities: {total_findings}")
+    out(f"Critical Issues: {critical_count}")
+    out(f"High-Risk Issues: {high_count}")
     
     if critical_count > 0:
-        print(f"\n🚨 IMMEDIATE ACTION REQUIRED: {critical_count} critical vulnerabilities detected!")
-        print("This infrastructure configuration poses significant security risks.")
+        out(f"\n🚨 IMMEDIATE ACTION REQUIRED: {critical_count} critical vulnerabilities detected!")
+        out("This infrastructure configuration poses significant security risks.")
     
+    sys.stdout.write(''.join(buf))
+
     return findings
 
+def scan_terraform_files(terraform_files):
+    """Scan several Terraform files, fanning out across processes on demand
+
+    Per-file scans share nothing, so with SCANNER_PARALLELISM=N set to 2+
+    they run on a process pool; each worker compiles the combined regex
+    once (lru_cache) and reuses it for every file it scans. The default
+    stays serial, which is right for the single-file demo.
+    """
+    workers = int(os.environ.get("SCANNER_PARALLELISM", "1"))
+    if workers > 1 and len(terraform_files) > 1:
+        # Fork-start workers inherit the imported knowledge base and the
+        # cached combined regexes copy-on-write, so nothing is re-pickled
+        # or recompiled per task; where fork is unavailable (Windows,
+        # macOS spawn default) the platform default start method is used
+        # and each worker compiles once on its first file.
+        try:
+            ctx = multiprocessing.get_context("fork")
+        except ValueError:
+            ctx = None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+            return list(executor.map(analyze_terraform_vulnerabilities, terraform_files))
+    return [analyze_terraform_vulnerabilities(path) for path in terraform_files]
+
+
 def demonstrate_chromadb_advantages():
     """Explain the advantages of ChromaDB integration"""
     print("\n🧠 CHROMADB ENHANCED CAPABILITIES")
@@ -125,7 +286,7 @@ if __name__ == "__main__":
         exit(1)
     
     # Run vulnerability analysis
-    findings = analyze_terraform_vulnerabilities(terraform_file)
+    findings = scan_terraform_files([terraform_file])[0]
     
     # Demonstrate ChromaDB advantages
     demonstrate_chromadb_advantages()